@@ -1,6 +1,9 @@
+import click
 from flask import Flask
-from models import db, Product, Location, ProductMovement
+from models import db, Product, Location, ProductMovement, LedgerPartition
 from routes import main
+from reconcile import reconcile
+import ledger
 
 def create_app():
     app = Flask(__name__)
@@ -19,6 +22,75 @@ def create_app():
     # Create tables
     with app.app_context():
         db.create_all()
+        ledger.migrate_movement_ids()
+
+        # create_all skips existing tables, so add any indexes they are missing
+        for index in ProductMovement.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+
+    # CLI commands
+    @app.cli.command('reconcile')
+    @click.option('--workers', type=click.IntRange(min=1), default=None, help='Worker processes (default: one per CPU).')
+    @click.option('--chunk-size', type=click.IntRange(min=1), default=500, help='Products per chunk.')
+    @click.option('--fix', is_flag=True, help='Raise total_qty to allocated stock where it falls below.')
+    def reconcile_command(workers, chunk_size, fix):
+        """Check product totals against the movement ledger."""
+        try:
+            report = reconcile(workers=workers, chunk_size=chunk_size, fix=fix)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
+        for discrepancy in report['discrepancies']:
+            click.echo(f"{discrepancy['product_id']}: total_qty={discrepancy['total_qty']} "
+                       f"allocated={discrepancy['allocated']} issues={','.join(discrepancy['issues'])}")
+            for location_id, balance in discrepancy['negative_locations'].items():
+                click.echo(f"  {location_id}: balance {balance}")
+
+        click.echo(f"Checked {report['products_checked']} products in {report['chunks']} chunks: "
+                   f"{len(report['discrepancies'])} discrepancies, {len(report['fixed'])} fixed.")
+
+    @app.cli.group('ledger')
+    def ledger_command():
+        """Manage monthly movement ledger partitions."""
+
+    @ledger_command.command('list')
+    def ledger_list():
+        """List archived partitions."""
+        for partition in LedgerPartition.query.order_by(LedgerPartition.month).all():
+            click.echo(f"{partition.month}: {partition.row_count} movements, {partition.status} ({partition.filename})")
+        click.echo(f"Active ledger: {ProductMovement.query.count()} movements")
+
+    @ledger_command.command('archive')
+    @click.option('--before', 'month', required=True, help='Archive every month before this one (YYYY-MM).')
+    def ledger_archive(month):
+        """Move old months into read-only partition files."""
+        try:
+            partitions = ledger.archive_before(month)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        for partition in partitions:
+            click.echo(f"Archived {partition.row_count} movements to {partition.filename}")
+        click.echo(f"Archived {len(partitions)} months.")
+
+    @ledger_command.command('detach')
+    @click.argument('month')
+    def ledger_detach(month):
+        """Hide a partition's movements; balances still include them."""
+        try:
+            ledger.detach_partition(month)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Detached {month}.")
+
+    @ledger_command.command('attach')
+    @click.argument('month')
+    def ledger_attach(month):
+        """Show a detached partition's movements again."""
+        try:
+            ledger.attach_partition(month)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Attached {month}.")
     
     return app
 
@@ -0,0 +1,385 @@
+import os
+from datetime import datetime
+from flask import current_app
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import create_engine
+from models import db, Product, Location, ProductMovement, LedgerPartition, LedgerPartitionBalance
+
+# Schema of the movements table inside each partition file. Products and
+# locations live in the main database, so there are no foreign keys here.
+partition_metadata = db.MetaData()
+partition_movements = db.Table(
+    'product_movements', partition_metadata,
+    db.Column('movement_id', db.Integer, primary_key=True),
+    db.Column('timestamp', db.DateTime, nullable=False, index=True),
+    db.Column('from_location', db.String(50)),
+    db.Column('to_location', db.String(50)),
+    db.Column('product_id', db.String(50), nullable=False),
+    db.Column('qty', db.Integer, nullable=False),
+    db.Column('notes', db.Text)
+)
+
+# Read-only engines for attached partitions, keyed by file path
+_read_engines = {}
+
+class ArchivedMovement:
+    """A read-only movement loaded from an archived ledger partition"""
+
+    archived = True
+
+    def __init__(self, row, month):
+        self.movement_id = row.movement_id
+        self.timestamp = row.timestamp
+        self.from_location = row.from_location
+        self.to_location = row.to_location
+        self.product_id = row.product_id
+        self.qty = row.qty
+        self.notes = row.notes
+        self.month = month
+
+    def __repr__(self):
+        return f'<ArchivedMovement {self.movement_id}: {self.product_id} qty:{self.qty} ({self.month})>'
+
+    # Same attributes the templates use on ProductMovement
+    movement_type = ProductMovement.movement_type
+
+    @property
+    def product(self):
+        return db.session.get(Product, self.product_id)
+
+    @property
+    def from_loc(self):
+        return db.session.get(Location, self.from_location) if self.from_location else None
+
+    @property
+    def to_loc(self):
+        return db.session.get(Location, self.to_location) if self.to_location else None
+
+def month_start(month):
+    """Parse a YYYY-MM string into the first moment of that month"""
+    try:
+        return datetime.strptime(month, '%Y-%m')
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid month '{month}', expected YYYY-MM")
+
+def next_month(start):
+    """First moment of the month after start"""
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+
+def partition_path(partition):
+    """Absolute path of a partition's database file"""
+    return os.path.join(current_app.instance_path, 'ledger', partition.filename)
+
+def partition_file_exists(partition):
+    """Whether a partition's database file is in place"""
+    path = partition_path(partition)
+    if not os.path.exists(path) and os.path.exists(path + '.tmp'):
+        # The archive committed but stopped before renaming its file
+        _finish_pending_file(path)
+    return os.path.exists(path)
+
+def _read_engine(partition):
+    path = partition_path(partition)
+    partition_file_exists(partition)
+    if path not in _read_engines:
+        # mode=ro makes SQLite itself refuse writes to archived months
+        _read_engines[path] = create_engine(f'sqlite:///file:{path}?mode=ro&uri=true')
+    return _read_engines[path]
+
+def _close_engine(partition):
+    engine = _read_engines.pop(partition_path(partition), None)
+    if engine is not None:
+        engine.dispose()
+
+def _partition_filter(query, start, end):
+    """Restrict a partition query to [start, end)"""
+    if start is not None:
+        query = query.where(partition_movements.c.timestamp >= start)
+    if end is not None:
+        query = query.where(partition_movements.c.timestamp < end)
+    return query
+
+def _active_query(start, end):
+    """Active ledger movements in [start, end), newest first"""
+    query = ProductMovement.query
+    if start is not None:
+        query = query.filter(ProductMovement.timestamp >= start)
+    if end is not None:
+        query = query.filter(ProductMovement.timestamp < end)
+    return query.order_by(ProductMovement.timestamp.desc())
+
+def partitions_for_range(start=None, end=None):
+    """Attached partitions overlapping [start, end), newest first; the rest are never opened"""
+    partitions = LedgerPartition.query.filter_by(status='attached').order_by(LedgerPartition.month.desc()).all()
+    selected = []
+    for partition in partitions:
+        partition_start = month_start(partition.month)
+        partition_end = next_month(partition_start)
+        if end is not None and partition_start >= end:
+            continue
+        if start is not None and partition_end <= start:
+            continue
+        selected.append(partition)
+    return selected
+
+def _partition_count(partition, start, end):
+    """Movements in a partition within [start, end)"""
+    partition_start = month_start(partition.month)
+    partition_end = next_month(partition_start)
+
+    # Partitions wholly inside the range are counted from the registry
+    if (start is None or start <= partition_start) and (end is None or partition_end <= end):
+        return partition.row_count
+
+    query = _partition_filter(db.select(db.func.count()).select_from(partition_movements), start, end)
+    with _read_engine(partition).connect() as connection:
+        return connection.execute(query).scalar()
+
+def _partition_rows(partition, start, end, offset, limit):
+    """A page of movements from a partition within [start, end), newest first"""
+    query = _partition_filter(db.select(partition_movements), start, end)
+    query = query.order_by(partition_movements.c.timestamp.desc()).offset(offset).limit(limit)
+    with _read_engine(partition).connect() as connection:
+        return [ArchivedMovement(row, partition.month) for row in connection.execute(query)]
+
+class LedgerPagination(Pagination):
+    """Paginates the active ledger, then archived partitions, skipping sources before the page by count"""
+
+    def _source_counts(self):
+        if not hasattr(self, '_counts'):
+            start = self._query_args['start']
+            end = self._query_args['end']
+            self._counts = [(None, _active_query(start, end).order_by(None).count())]
+            for partition in partitions_for_range(start, end):
+                self._counts.append((partition, _partition_count(partition, start, end)))
+        return self._counts
+
+    def _query_items(self):
+        start = self._query_args['start']
+        end = self._query_args['end']
+        offset = self._query_offset
+        remaining = self.per_page
+        items = []
+
+        # Archived months are always older than the active ledger, so sources read back to back
+        for partition, count in self._source_counts():
+            if remaining == 0:
+                break
+            if offset >= count:
+                offset -= count
+                continue
+
+            if partition is None:
+                rows = _active_query(start, end).offset(offset).limit(remaining).all()
+            else:
+                rows = _partition_rows(partition, start, end, offset, remaining)
+            items.extend(rows)
+            remaining -= len(rows)
+            offset = 0
+
+        return items
+
+    def _query_count(self):
+        return sum(count for _, count in self._source_counts())
+
+def paginate_movements(page=None, per_page=20, start=None, end=None, error_out=False):
+    """Paginate movements across the active ledger and attached partitions"""
+    return LedgerPagination(page=page, per_page=per_page, error_out=error_out, start=start, end=end)
+
+def count_movements():
+    """Total movements in the active ledger and attached partitions"""
+    archived = db.session.query(db.func.sum(LedgerPartition.row_count)).filter(
+        LedgerPartition.status == 'attached'
+    ).scalar() or 0
+    return ProductMovement.query.count() + archived
+
+def is_archived(movement_id):
+    """Whether a movement ID belongs to an archived partition"""
+    candidates = LedgerPartition.query.filter(
+        LedgerPartition.min_movement_id <= movement_id,
+        LedgerPartition.max_movement_id >= movement_id
+    ).all()
+
+    # ID ranges can overlap the active ledger, so confirm against the partition file
+    query = db.select(partition_movements.c.movement_id).where(partition_movements.c.movement_id == movement_id)
+    for partition in candidates:
+        if not partition_file_exists(partition):
+            continue
+        with _read_engine(partition).connect() as connection:
+            if connection.execute(query).first() is not None:
+                return True
+    return False
+
+def has_archived_movements(product_id=None, location_id=None):
+    """Whether any archived partition holds movements for a product or location"""
+    query = LedgerPartitionBalance.query
+    if product_id is not None:
+        query = query.filter(LedgerPartitionBalance.product_id == product_id)
+    if location_id is not None:
+        query = query.filter(LedgerPartitionBalance.location_id == location_id)
+    return query.first() is not None
+
+def _raise_movement_sequence(connection, value):
+    """Make sure SQLite never hands out a movement ID at or below value"""
+    connection.execute(db.text(
+        "UPDATE sqlite_sequence SET seq = :value WHERE name = 'product_movements' AND seq < :value"
+    ), {'value': value})
+    connection.execute(db.text(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'product_movements', :value "
+        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'product_movements')"
+    ), {'value': value})
+
+def migrate_movement_ids():
+    """Rebuild a product_movements table created without AUTOINCREMENT (one-off)"""
+    with db.engine.begin() as connection:
+        table_sql = connection.execute(db.text(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'product_movements'"
+        )).scalar()
+        if table_sql is None or 'AUTOINCREMENT' in table_sql.upper():
+            return
+
+        columns = ', '.join(column.name for column in ProductMovement.__table__.columns)
+        connection.execute(db.text("ALTER TABLE product_movements RENAME TO product_movements_old"))
+        # The renamed table keeps its indexes, which would clash with the new ones
+        for index in ProductMovement.__table__.indexes:
+            connection.execute(db.text(f"DROP INDEX IF EXISTS {index.name}"))
+        ProductMovement.__table__.create(connection)
+        connection.execute(db.text(
+            f"INSERT INTO product_movements ({columns}) SELECT {columns} FROM product_movements_old"
+        ))
+        connection.execute(db.text("DROP TABLE product_movements_old"))
+
+        active_max = connection.execute(db.select(db.func.max(ProductMovement.movement_id))).scalar() or 0
+        archived_max = connection.execute(db.select(db.func.max(LedgerPartition.max_movement_id))).scalar() or 0
+        _raise_movement_sequence(connection, max(active_max, archived_max))
+
+def archive_before(month):
+    """Move every active movement older than month (YYYY-MM) into monthly partitions, oldest first"""
+    cutoff = month_start(month)
+    current = month_start(datetime.utcnow().strftime('%Y-%m'))
+    if cutoff > current:
+        raise ValueError("Only months before the current month can be archived")
+
+    archived = []
+    while True:
+        oldest = db.session.query(db.func.min(ProductMovement.timestamp)).filter(
+            ProductMovement.timestamp < cutoff
+        ).scalar()
+        if oldest is None:
+            break
+        archived.append(_archive_month(oldest.strftime('%Y-%m')))
+
+    return archived
+
+def _archive_month(month):
+    if db.session.get(LedgerPartition, month):
+        raise ValueError(f"Ledger partition {month} already exists")
+
+    start = month_start(month)
+    end = next_month(start)
+
+    # Registering the partition first takes SQLite's write lock, so the month
+    # cannot be edited between reading its movements and the commit
+    partition = LedgerPartition(
+        month=month,
+        filename=f'movements_{month.replace("-", "_")}.db',
+        status='attached',
+        row_count=0
+    )
+    db.session.add(partition)
+    db.session.flush()
+
+    movements = _active_query(start, end).populate_existing().all()
+    if not movements:
+        db.session.rollback()
+        raise ValueError(f"No movements to archive for {month}")
+
+    partition.row_count = len(movements)
+    partition.min_movement_id = min(movement.movement_id for movement in movements)
+    partition.max_movement_id = max(movement.movement_id for movement in movements)
+    path = partition_path(partition)
+    pending_path = path + '.tmp'
+
+    # No registry row exists, so any file here is left over from an interrupted archive
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    for stale_path in (path, pending_path):
+        if os.path.exists(stale_path):
+            os.chmod(stale_path, 0o644)
+            os.remove(stale_path)
+
+    # Write under a temporary name; it only takes the partition's name once the rows leave the active ledger
+    engine = create_engine(f'sqlite:///{pending_path}')
+    try:
+        partition_metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(partition_movements.insert(), [{
+                'movement_id': movement.movement_id,
+                'timestamp': movement.timestamp,
+                'from_location': movement.from_location,
+                'to_location': movement.to_location,
+                'product_id': movement.product_id,
+                'qty': movement.qty,
+                'notes': movement.notes
+            } for movement in movements])
+    except Exception:
+        engine.dispose()
+        db.session.rollback()
+        os.remove(pending_path)
+        raise
+    engine.dispose()
+
+    # Summarise the month so balances never need to open the partition
+    balances = {}
+    for movement in movements:
+        if movement.to_location:
+            key = (movement.product_id, movement.to_location)
+            balances[key] = balances.get(key, 0) + movement.qty
+        if movement.from_location:
+            key = (movement.product_id, movement.from_location)
+            balances[key] = balances.get(key, 0) - movement.qty
+
+    try:
+        for (product_id, location_id), qty in balances.items():
+            db.session.add(LedgerPartitionBalance(month=month, product_id=product_id,
+                                                  location_id=location_id, qty=qty))
+        for movement in movements:
+            db.session.delete(movement)
+        _raise_movement_sequence(db.session.connection(), partition.max_movement_id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        os.remove(pending_path)
+        raise
+
+    _finish_pending_file(path)
+    return partition
+
+def _finish_pending_file(path):
+    """Move a committed partition file into place and make it read-only"""
+    os.replace(path + '.tmp', path)
+    os.chmod(path, 0o444)
+
+def detach_partition(month):
+    """Stop reading a partition's movements; its balances still count"""
+    partition = db.session.get(LedgerPartition, month)
+    if not partition:
+        raise ValueError(f"Ledger partition {month} does not exist")
+
+    partition.status = 'detached'
+    db.session.commit()
+    _close_engine(partition)
+    return partition
+
+def attach_partition(month):
+    """Make a detached partition's movements visible again"""
+    partition = db.session.get(LedgerPartition, month)
+    if not partition:
+        raise ValueError(f"Ledger partition {month} does not exist")
+    if not partition_file_exists(partition):
+        raise ValueError(f"Partition file {partition.filename} is missing")
+
+    partition.status = 'attached'
+    db.session.commit()
+    return partition
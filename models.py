@@ -29,7 +29,13 @@ class Product(db.Model):
             ProductMovement.from_location == location_id
         ).scalar() or 0
         
-        return incoming - outgoing
+        # Movements in archived ledger partitions are kept as summarised balances
+        archived = db.session.query(db.func.sum(LedgerPartitionBalance.qty)).filter(
+            LedgerPartitionBalance.product_id == self.product_id,
+            LedgerPartitionBalance.location_id == location_id
+        ).scalar() or 0
+        
+        return incoming - outgoing + archived
     
     def get_total_allocated(self):
         """Get total quantity allocated across all locations"""
@@ -44,7 +50,11 @@ class Product(db.Model):
             ProductMovement.from_location.isnot(None)
         ).scalar() or 0
         
-        return incoming - outgoing
+        archived = db.session.query(db.func.sum(LedgerPartitionBalance.qty)).filter(
+            LedgerPartitionBalance.product_id == self.product_id
+        ).scalar() or 0
+        
+        return incoming - outgoing + archived
     
     def get_available_stock(self):
         """Get available stock that can be moved out"""
@@ -84,15 +94,20 @@ class Location(db.Model):
 
 class ProductMovement(db.Model):
     __tablename__ = 'product_movements'
+    # Never reuse IDs, even after the newest rows are archived
+    __table_args__ = {'sqlite_autoincrement': True}
     
     movement_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
     from_location = db.Column(db.String(50), db.ForeignKey('locations.location_id'), nullable=True)
     to_location = db.Column(db.String(50), db.ForeignKey('locations.location_id'), nullable=True)
-    product_id = db.Column(db.String(50), db.ForeignKey('products.product_id'), nullable=False)
+    product_id = db.Column(db.String(50), db.ForeignKey('products.product_id'), nullable=False, index=True)
     qty = db.Column(db.Integer, nullable=False)
     notes = db.Column(db.Text)
     
+    # Rows in this table form the active ledger; archived ones are read-only
+    archived = False
+    
     def __repr__(self):
         return f'<Movement {self.movement_id}: {self.product_id} qty:{self.qty}>'
     
@@ -195,3 +210,32 @@ class ProductMovement(db.Model):
     def __init__(self, **kwargs):
         super(ProductMovement, self).__init__(**kwargs)
         # Validation will be called explicitly in routes
+
+class LedgerPartition(db.Model):
+    __tablename__ = 'ledger_partitions'
+    
+    month = db.Column(db.String(7), primary_key=True)  # YYYY-MM
+    filename = db.Column(db.String(100), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='attached')  # attached or detached
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    min_movement_id = db.Column(db.Integer)
+    max_movement_id = db.Column(db.Integer)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    # Summarised balances of the movements in this partition
+    balances = db.relationship('LedgerPartitionBalance', backref='partition', lazy=True)
+    
+    def __repr__(self):
+        return f'<LedgerPartition {self.month}: {self.row_count} movements ({self.status})>'
+
+class LedgerPartitionBalance(db.Model):
+    __tablename__ = 'ledger_partition_balances'
+    
+    # Net quantity a partition's movements moved into (or out of) a location for a product
+    product_id = db.Column(db.String(50), db.ForeignKey('products.product_id'), primary_key=True)
+    location_id = db.Column(db.String(50), db.ForeignKey('locations.location_id'), primary_key=True)
+    month = db.Column(db.String(7), db.ForeignKey('ledger_partitions.month'), primary_key=True)
+    qty = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<LedgerPartitionBalance {self.month}: {self.product_id}@{self.location_id} qty:{self.qty}>'
@@ -0,0 +1,120 @@
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import create_engine, func
+from models import db, Product, ProductMovement, LedgerPartitionBalance
+
+# Engine used by pool workers, created once per worker process
+_worker_engine = None
+
+def _init_worker(database_uri):
+    """Open a private database engine in each pool worker"""
+    global _worker_engine
+    _worker_engine = create_engine(database_uri)
+
+def _check_chunk(chunk):
+    """Pool entry point: check one chunk of products"""
+    with _worker_engine.connect() as connection:
+        return check_products(connection, chunk)
+
+def check_products(connection, chunk):
+    """Check a chunk of (product_id, total_qty) rows for negative balances and under-allocated totals"""
+    movements = ProductMovement.__table__.c
+    archived_balances = LedgerPartitionBalance.__table__.c
+    product_ids = [product_id for product_id, _ in chunk]
+
+    # One grouped pass per direction instead of two queries per product/location
+    incoming = connection.execute(
+        db.select(movements.product_id, movements.to_location, func.sum(movements.qty))
+        .where(movements.product_id.in_(product_ids), movements.to_location.isnot(None))
+        .group_by(movements.product_id, movements.to_location)
+    ).all()
+    outgoing = connection.execute(
+        db.select(movements.product_id, movements.from_location, func.sum(movements.qty))
+        .where(movements.product_id.in_(product_ids), movements.from_location.isnot(None))
+        .group_by(movements.product_id, movements.from_location)
+    ).all()
+    # Archived partitions contribute through their summarised balances
+    archived = connection.execute(
+        db.select(archived_balances.product_id, archived_balances.location_id, func.sum(archived_balances.qty))
+        .where(archived_balances.product_id.in_(product_ids))
+        .group_by(archived_balances.product_id, archived_balances.location_id)
+    ).all()
+
+    balances = {}
+    for product_id, location_id, qty in incoming + archived:
+        product_balances = balances.setdefault(product_id, {})
+        product_balances[location_id] = product_balances.get(location_id, 0) + qty
+    for product_id, location_id, qty in outgoing:
+        product_balances = balances.setdefault(product_id, {})
+        product_balances[location_id] = product_balances.get(location_id, 0) - qty
+
+    discrepancies = []
+    for product_id, total_qty in chunk:
+        product_balances = balances.get(product_id, {})
+        allocated = sum(product_balances.values())
+        unallocated = total_qty - allocated
+        negative_locations = {
+            location_id: balance
+            for location_id, balance in product_balances.items()
+            if balance < 0
+        }
+
+        issues = []
+        if unallocated < 0:
+            issues.append('total_qty_below_allocated')
+        if negative_locations:
+            issues.append('negative_location_balance')
+
+        if issues:
+            discrepancies.append({
+                'product_id': product_id,
+                'total_qty': total_qty,
+                'allocated': allocated,
+                'unallocated': unallocated,
+                'negative_locations': negative_locations,
+                'issues': issues
+            })
+
+    return discrepancies
+
+def reconcile(workers=None, chunk_size=500, fix=False):
+    """Check every product's total_qty against the movement ledger in chunks, optionally fixing shortfalls"""
+    if chunk_size <= 0:
+        raise ValueError("Chunk size must be positive")
+
+    products = db.session.query(Product.product_id, Product.total_qty).order_by(Product.product_id).all()
+    rows = [(product_id, total_qty) for product_id, total_qty in products]
+    chunks = [rows[start:start + chunk_size] for start in range(0, len(rows), chunk_size)]
+
+    # In-memory databases are private to this process, so they are always checked inline
+    in_memory = db.engine.url.database in (None, '', ':memory:')
+    if workers == 1 or len(chunks) <= 1 or in_memory:
+        connection = db.session.connection()
+        results = [check_products(connection, chunk) for chunk in chunks]
+    else:
+        database_uri = db.engine.url.render_as_string(hide_password=False)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(database_uri,)) as pool:
+            results = list(pool.map(_check_chunk, chunks))
+
+    discrepancies = [discrepancy for chunk_result in results for discrepancy in chunk_result]
+
+    fixed = []
+    if fix:
+        for discrepancy in discrepancies:
+            if 'total_qty_below_allocated' in discrepancy['issues']:
+                # Recompute in this transaction; the scan may be stale by now
+                product = Product.query.get(discrepancy['product_id'])
+                if not product:
+                    continue
+                allocated = product.get_total_allocated()
+                if allocated > product.total_qty:
+                    product.total_qty = allocated
+                    fixed.append(product.product_id)
+        db.session.commit()
+
+    return {
+        'products_checked': len(rows),
+        'chunks': len(chunks),
+        'discrepancies': discrepancies,
+        'fixed': fixed
+    }
@@ -1,6 +1,8 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, abort
 from models import db, Product, Location, ProductMovement
-from datetime import datetime
+from reconcile import reconcile
+from ledger import paginate_movements, count_movements, is_archived, has_archived_movements
+from datetime import datetime, timedelta
 
 main = Blueprint('main', __name__)
 
@@ -10,7 +12,7 @@ def index():
     # Get quick stats for dashboard
     products_count = Product.query.count()
     locations_count = Location.query.count()
-    movements_count = ProductMovement.query.count()
+    movements_count = count_movements()
     
     # Count inventory items (products with stock in any location)
     inventory_items = 0
@@ -102,6 +104,11 @@ def edit_product(product_id):
 def delete_product(product_id):
     product = Product.query.get_or_404(product_id)
     
+    # Archived partitions are read-only, so their movements cannot be reversed
+    if has_archived_movements(product_id=product_id):
+        flash(f'Product "{product.name}" has movements in archived ledger partitions and cannot be deleted.', 'error')
+        return redirect(url_for('main.products'))
+    
     try:
         # Check if product has movements
         movements = ProductMovement.query.filter_by(product_id=product_id).all()
@@ -174,6 +181,10 @@ def edit_location(location_id):
 def delete_location(location_id):
     location = Location.query.get_or_404(location_id)
     
+    if has_archived_movements(location_id=location_id):
+        flash(f'Location "{location.name}" has movements in archived ledger partitions and cannot be deleted.', 'error')
+        return redirect(url_for('main.locations'))
+    
     try:
         # Check if location has movements (either as from_location or to_location)
         movements_from = ProductMovement.query.filter_by(from_location=location_id).all()
@@ -212,9 +223,19 @@ def delete_location(location_id):
 @main.route('/movements')
 def movements():
     page = request.args.get('page', 1, type=int)
-    movements = ProductMovement.query.order_by(ProductMovement.timestamp.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    
+    # Optional date range (inclusive dates); only partitions it overlaps are read
+    start = end = None
+    try:
+        if request.args.get('start'):
+            start = datetime.strptime(request.args['start'], '%Y-%m-%d')
+        if request.args.get('end'):
+            end = datetime.strptime(request.args['end'], '%Y-%m-%d') + timedelta(days=1)
+    except ValueError:
+        flash('Dates must be in YYYY-MM-DD format.', 'error')
+        start = end = None
+    
+    movements = paginate_movements(page=page, per_page=20, start=start, end=end)
     return render_template('movements.html', movements=movements)
 
 @main.route('/movements/add', methods=['GET', 'POST'])
@@ -280,7 +301,13 @@ def add_movement():
 
 @main.route('/movements/edit/<int:movement_id>', methods=['GET', 'POST'])
 def edit_movement(movement_id):
-    movement = ProductMovement.query.get_or_404(movement_id)
+    movement = db.session.get(ProductMovement, movement_id)
+    if movement is None:
+        # Only IDs missing from the active ledger can belong to an archived partition
+        if is_archived(movement_id):
+            flash(f'Movement #{movement_id} is in an archived ledger partition and is read-only.', 'error')
+            return redirect(url_for('main.movements'))
+        abort(404)
     original_qty = movement.qty
     original_product_id = movement.product_id
     original_from_location = movement.from_location
@@ -361,7 +388,13 @@ def edit_movement(movement_id):
 
 @main.route('/movements/delete/<int:movement_id>', methods=['POST'])
 def delete_movement(movement_id):
-    movement = ProductMovement.query.get_or_404(movement_id)
+    movement = db.session.get(ProductMovement, movement_id)
+    if movement is None:
+        # Only IDs missing from the active ledger can belong to an archived partition
+        if is_archived(movement_id):
+            flash(f'Movement #{movement_id} is in an archived ledger partition and is read-only.', 'error')
+            return redirect(url_for('main.movements'))
+        abort(404)
     
     try:
         # Reverse the stock changes before deleting
@@ -387,7 +420,7 @@ def delete_movement(movement_id):
 @main.route('/movements/clear_all', methods=['POST'])
 def clear_all_movements():
     try:
-        # Get all movements
+        # Get all movements in the active ledger (archived partitions are read-only)
         movements = ProductMovement.query.all()
         movements_count = len(movements)
         
@@ -403,7 +436,10 @@ def clear_all_movements():
         ProductMovement.query.delete()
         db.session.commit()
         
-        flash(f'All {movements_count} movements cleared successfully! All product stock quantities have been reset.', 'success')
+        if has_archived_movements():
+            flash(f'{movements_count} active movements cleared successfully! Archived ledger partitions were kept.', 'success')
+        else:
+            flash(f'All {movements_count} movements cleared successfully! All product stock quantities have been reset.', 'success')
         
     except Exception as e:
         db.session.rollback()
@@ -462,3 +498,16 @@ def api_inventory_data():
             })
     
     return jsonify(data)
+
+@main.route('/api/reconcile', methods=['GET', 'POST'])
+def api_reconcile():
+    """Check product totals against the movement ledger (POST also applies fixes)"""
+    chunk_size = request.args.get('chunk_size', 500, type=int)
+    
+    # Runs inline; the process pool is only started from the CLI command
+    try:
+        report = reconcile(workers=1, chunk_size=chunk_size, fix=request.method == 'POST')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify(report)